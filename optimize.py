@@ -1,226 +1,990 @@
 import os
 import argparse
 import yaml
+import httpx
 import subprocess
 import sys
-from pathlib import Path
-from typing import List, Callable, Optional
-import concurrent.futures
+from pathlib import Path, PurePosixPath
+from typing import List, Callable, Awaitable, Dict, Iterable, Iterator, Optional, Pattern, Tuple
+import ast
+import asyncio
+import contextlib
+import dataclasses
+import fcntl
+import functools
+import heapq
+import hashlib
+import math
+import queue
+import re
+import sqlite3
 import logging
+import logging.handlers
+import shlex
 import shutil
 import tempfile
+import time
+import urllib.parse
+
+GITHUB_API_URL = "https://api.github.com"
+
+# Commands and tools whose failures may be transient (network access), mapped to the
+# number of attempts. Anything not listed fails deterministically and runs only once.
+RETRY_ATTEMPTS = {
+    'git': 3,
+    'pip': 3,
+    'safety': 3,
+    'sourcery': 3,
+    'trufflehog': 3,
+}
+RETRY_BASE_DELAY = 2  # Seconds before the first retry, doubled for every further attempt
+
+# Virtual environments shared across runs, keyed by interpreter and requirements
+VENV_CACHE_DIR = Path.home() / ".cache" / "autopr" / "venvs"
+
+# Requirements file lines that pull in another file (-r/--requirement, -c/--constraint), which is keyed too
+REQUIREMENTS_INCLUDE = re.compile(r'\s*(?:-[rc]\s*|--(?:requirement|constraint)(?:\s*=\s*|\s+))(\S+)')
+
+# Installed into every virtual environment so validation runs can spread tests over all cores
+TEST_PACKAGES = ('pytest', 'pytest-xdist')
+PYTEST_NO_TESTS_COLLECTED = 5  # pytest's exit code when no test was found
+
+# Environment for git commands that talk to the remote: never block on a credential
+# prompt, and abort transfers slower than 1 KB/s for a minute instead of hanging
+GIT_NETWORK_ENV = {
+    'GIT_TERMINAL_PROMPT': '0',
+    'GIT_HTTP_LOW_SPEED_LIMIT': '1000',
+    'GIT_HTTP_LOW_SPEED_TIME': '60',
+}
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 # =========================== Setup Logging ===========================
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@contextlib.contextmanager
+def queued_logging() -> Iterator[None]:
+    """
+    Hand log records to a listener thread that writes them out, for the duration of the block.
+
+    The thread that logs still formats each message and takes the queue
+    handler's lock to enqueue it; only the stream write, which can block on
+    a slow terminal or pipe, moves off the pipeline and asyncio workers.
+    """
+    root = logging.getLogger()
+    handlers = root.handlers
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    try:
+        yield
+    finally:
+        root.handlers = handlers
+        listener.stop()  # Writes the records still queued
+
 # =========================== Helper Functions ===========================
 
 def load_config(config_path: str) -> dict:
-    """Load and parse the configuration YAML file."""
+    """Load and parse the configuration YAML file, reusing the parsed result while the file is unchanged."""
     if not os.path.exists(config_path):
         raise FileNotFoundError(f"Configuration file '{config_path}' not found.")
+    return parse_config(os.path.abspath(config_path), os.path.getmtime(config_path))
+
+@functools.lru_cache(maxsize=8)
+def parse_config(config_path: str, mtime: float) -> dict:
+    """Parse a configuration file; the modification time is part of the cache key so edits are picked up."""
     with open(config_path, 'r') as file:
-        config = yaml.safe_load(file)
+        config = yaml.load(file, Loader=SafeLoader)
     return config
 
-def clone_repository(repo_url: str, branch: str, auth_token: str, repo_name: str) -> Path:
-    """Clone the repository from GitHub."""
-    logger.info(f"Cloning repository '{repo_name}'...")
+def run_with_retry(kind: str, argv: List[str], **kwargs) -> subprocess.CompletedProcess:
+    """Run a command, retrying with exponential backoff if its kind is listed in RETRY_ATTEMPTS."""
+    attempts = RETRY_ATTEMPTS.get(kind, 1)
+    for attempt in range(attempts - 1):
+        try:
+            return subprocess.run(argv, check=True, **kwargs)
+        except subprocess.CalledProcessError as e:
+            delay = RETRY_BASE_DELAY * 2 ** attempt
+            logger.warning("%s failed (Attempt %s/%s), retrying in %.0fs: %s", kind, attempt + 1, attempts, delay, e)
+            time.sleep(delay)
+    return subprocess.run(argv, check=True, **kwargs)
+
+def acquire_file_lock(lock_path: Path) -> int:
+    """Wait for an exclusive fcntl lock on a file and return its descriptor; closing it, or the process dying, releases the lock."""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lock_fd = os.open(str(lock_path), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+    except BaseException:
+        os.close(lock_fd)
+        raise
+    return lock_fd
+
+@contextlib.contextmanager
+def file_lock(lock_path: Path) -> Iterator[None]:
+    """Hold an exclusive fcntl lock on a file for the duration of the block."""
+    lock_fd = acquire_file_lock(lock_path)
+    try:
+        yield
+    finally:
+        os.close(lock_fd)  # Closing the descriptor drops the lock
+
+def repository_lock_path(repo_name: str) -> Path:
+    """Return the lock file serializing runs that share the clone of a repository."""
+    return Path("./cloned_repos").resolve() / f".{repo_name}.lock"
+
+def clone_repository(repo_url: str, branch: str, auth_token: str, repo_name: str, sparse_paths: Optional[List[str]] = None) -> Path:
+    """
+    Clone the repository from GitHub, or refresh a clone left by a previous run.
+
+    When sparse_paths is given, a fresh clone is a blobless partial clone that
+    only materializes those paths in the working tree. A refreshed clone
+    re-applies the paths, so configuration changes take effect without a
+    new clone. The caller must hold the lock at repository_lock_path.
+    """
     clone_url = repo_url.replace("https://", f"https://{auth_token}@")
-    target_path = Path(f"./cloned_repos/{repo_name}")
-    if target_path.exists():
-        shutil.rmtree(target_path)  # Clean previous clone if exists
+    target_path = Path(f"./cloned_repos/{repo_name}").resolve()  # Absolute, so later steps do not depend on the cwd
+    git = ['git', '-C', str(target_path)]
+    network_env = {**os.environ, **GIT_NETWORK_ENV}
+    # Non-cone patterns, since paths_to_optimize may name single files
+    sparse_patterns = [f"/{path.strip('/')}" for path in sparse_paths or []]
 
     try:
-        subprocess.run(['git', 'clone', '-b', branch, clone_url, str(target_path)], check=True)
+        if (target_path / '.git').is_dir():
+            # Reuse the existing objects and only transfer what changed upstream
+            logger.info("Updating existing clone of repository '%s'...", repo_name)
+            subprocess.run([*git, 'remote', 'set-url', 'origin', clone_url], check=True)
+            run_with_retry('git', [*git, 'fetch', '--depth=1', '--prune', 'origin', branch], env=network_env)
+            subprocess.run([*git, 'checkout', '--force', '-B', branch, 'FETCH_HEAD'], check=True, env=network_env)
+            if sparse_patterns:
+                subprocess.run([*git, 'sparse-checkout', 'set', '--no-cone', *sparse_patterns], check=True, env=network_env)
+            elif subprocess.run([*git, 'config', '--bool', 'core.sparseCheckout'], capture_output=True, text=True).stdout.strip() == 'true':
+                # Sparse checkout was turned off since the previous run
+                subprocess.run([*git, 'sparse-checkout', 'disable'], check=True, env=network_env)
+            subprocess.run([*git, 'clean', '-fdx'], check=True)
+        else:
+            logger.info("Cloning repository '%s'...", repo_name)
+            if target_path.exists():
+                shutil.rmtree(target_path)  # Clean leftovers that are not a usable clone
+            if sparse_patterns:
+                run_with_retry('git', ['git', 'clone', '--filter=blob:none', '--depth=1', '--single-branch', '--no-checkout', '-b', branch, clone_url, str(target_path)], env=network_env)
+                subprocess.run([*git, 'sparse-checkout', 'set', '--no-cone', *sparse_patterns], check=True)
+                subprocess.run([*git, 'checkout', branch], check=True, env=network_env)  # Fetches the missing blobs
+            else:
+                run_with_retry('git', ['git', 'clone', '--depth=1', '--single-branch', '-b', branch, clone_url, str(target_path)], env=network_env)
     except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to clone repository '{repo_name}': {e}")
+        logger.error("Failed to clone repository '%s': %s", repo_name, e)
         raise
     return target_path
 
-def create_virtual_environment(target_path: Path) -> Path:
-    """Create a virtual environment for isolated testing."""
-    venv_path = target_path / 'venv'
-    logger.info(f"Creating virtual environment in {venv_path}...")
-    subprocess.run([sys.executable, '-m', 'venv', str(venv_path)], check=True)
+def create_virtual_environment(venv_path: Path) -> Path:
+    """Create a virtual environment for isolated testing, with uv when it is available."""
+    logger.info("Creating virtual environment in %s...", venv_path)
+    uv = shutil.which('uv')
+    if uv:
+        subprocess.run([uv, 'venv', '--quiet', '--python', sys.executable, str(venv_path)], check=True)
+    else:
+        subprocess.run([sys.executable, '-m', 'venv', str(venv_path)], check=True)
     return venv_path
 
-def install_requirements(requirements_path: Path, venv_path: Path) -> None:
-    """Install Python dependencies using pip inside the virtual environment."""
-    if requirements_path.exists():
-        logger.info(f"Installing requirements from {requirements_path}...")
-        try:
-            pip_executable = venv_path / 'bin' / 'pip'
-            subprocess.run([str(pip_executable), 'install', '-r', str(requirements_path)], check=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to install requirements from '{requirements_path}': {e}")
-            raise
+def install_requirements(requirements_paths: List[Path], venv_path: Path, packages: Tuple[str, ...] = ()) -> None:
+    """
+    Install Python dependencies from several requirements files with a single installer invocation.
+
+    uv downloads in parallel and resolves natively, so it is preferred when
+    available; pip is the fallback and still resolves all files at once.
+    Extra packages are resolved together with the requirements files.
+    """
+    existing = []
+    for requirements_path in dict.fromkeys(requirements_paths):
+        if requirements_path.exists():
+            existing.append(requirements_path)
+        else:
+            logger.warning("Requirements file not found at %s, skipping installation.", requirements_path)
+    if not existing and not packages:
+        return
+
+    logger.info("Installing requirements from %s...", ', '.join([*map(str, existing), *packages]))
+    requirement_args = [*(arg for path in existing for arg in ('-r', str(path))), *packages]
+    python_executable = venv_path / 'bin' / 'python'
+    uv = shutil.which('uv')
+    if uv:
+        argv = [uv, 'pip', 'install', '--python', str(python_executable), *requirement_args]
     else:
-        logger.warning(f"Requirements file not found at {requirements_path}, skipping installation.")
+        argv = [str(python_executable), '-m', 'pip', 'install', '--disable-pip-version-check', '--no-input', *requirement_args]
+    try:
+        run_with_retry('pip', argv)
+    except subprocess.CalledProcessError as e:
+        logger.error("Failed to install requirements from %s: %s", ', '.join([*map(str, existing), *packages]), e)
+        raise
+
+
+def included_requirements(requirements_paths: List[Path]) -> Dict[Path, bytes]:
+    """Read the existing requirements files together with the files they include, recursively, in a stable order."""
+    contents: Dict[Path, bytes] = {}
+    pending = list(requirements_paths)
+    for requirements_path in pending:  # Grows while included files are found
+        requirements_path = Path(os.path.normpath(requirements_path))  # So include cycles through '..' are recognized
+        if requirements_path in contents or not requirements_path.is_file():
+            continue
+        contents[requirements_path] = requirements_path.read_bytes()
+        for line in contents[requirements_path].decode(errors='replace').splitlines():
+            match = REQUIREMENTS_INCLUDE.match(line)
+            if match:
+                pending.append(requirements_path.parent / match.group(1))
+    return contents
+
+def cached_virtual_environment(requirements_paths: List[Path]) -> Path:
+    """
+    Return a virtual environment with the requirements installed, reusing one from a previous run.
 
+    Environments live outside the clones, keyed by the interpreter version and
+    the contents of the requirements files and of those they include, so
+    unchanged requirements are never reinstalled and repositories with the
+    same requirements share one.
+    """
+    digest = hashlib.blake2b(sys.version.encode(), digest_size=8)
+    digest.update(' '.join(TEST_PACKAGES).encode())
+    for content in included_requirements(requirements_paths).values():
+        digest.update(b'\x00' + content)
+    venv_path = VENV_CACHE_DIR / digest.hexdigest()
+    ready_marker = venv_path / '.autopr-ready'
+
+    # Repositories with the same requirements may reach this point concurrently
+    with file_lock(VENV_CACHE_DIR / f".{venv_path.name}.lock"):
+        if ready_marker.exists():
+            logger.info("Reusing cached virtual environment %s", venv_path)
+            return venv_path
+        if venv_path.exists():
+            shutil.rmtree(venv_path)  # Left behind by an interrupted install
+        create_virtual_environment(venv_path)
+        install_requirements(requirements_paths, venv_path, TEST_PACKAGES)
+        ready_marker.touch()
+    return venv_path
 
 def execute_custom_script(script_path: Path) -> None:
     """Execute a custom script, if it exists."""
     if script_path.exists():
-        logger.info(f"Executing custom script: {script_path}")
+        logger.info("Executing custom script: %s", script_path)
         try:
             subprocess.run(['bash', str(script_path)], check=True)
         except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to execute custom script '{script_path}': {e}")
+            logger.error("Failed to execute custom script '%s': %s", script_path, e)
             raise
 
 def run_tests(target_path: Path, venv_path: Path, run_tests_command: Optional[str] = "pytest") -> None:
-    """Run tests using the specified command inside the virtual environment."""
-    logger.info(f"Running tests in virtual environment {venv_path}...")
+    """
+    Run tests using the specified command inside the virtual environment, in parallel for pytest.
+
+    target_path should be the root of the repository: pytest only applies
+    its testpaths setting when started from its rootdir. A pytest run that
+    collects no tests counts as passing, since there is nothing to fail.
+    """
+    logger.info("Running tests in virtual environment %s...", venv_path)
+    argv = shlex.split(run_tests_command)
+    if argv[0] == 'pytest' and not any(arg.startswith(('-n', '--numprocesses')) for arg in argv[1:]):
+        argv += ['-n', 'auto', '-q', '--no-header']  # Distribute tests across cores with pytest-xdist
     try:
         python_executable = venv_path / 'bin' / 'python'
-        subprocess.run([str(python_executable), '-m', run_tests_command], cwd=str(target_path), check=True, shell=True)
+        result = subprocess.run([str(python_executable), '-m', *argv], cwd=str(target_path))
+        if argv[0] == 'pytest' and result.returncode == PYTEST_NO_TESTS_COLLECTED:
+            logger.info("No tests collected in %s, accepting the changes unvalidated.", target_path)
+            return
+        result.check_returncode()
     except subprocess.CalledProcessError as e:
-        logger.error(f"Tests failed: {e}")
+        logger.error("Tests failed: %s", e)
         raise
 
 # =========================== Optimization Functions ===========================
 
+# Upper bound on files handed to a single tool invocation, keeping argv well below ARG_MAX
+MAX_BATCH_SIZE = 1000
+
+# Persistent record of files each tool already processed, shared across runs
+CACHE_PATH = Path("./cloned_repos/.autopr_cache.sqlite")
+
+# Cache key under which file contents already known to parse are recorded
+SYNTAX_CHECK = "Syntax Check"
+
+# Repository files the tools read their settings from; cached results only hold while these are unchanged
+TOOL_CONFIG_FILES = (
+    'pyproject.toml', 'setup.cfg', 'tox.ini', '.flake8', 'ruff.toml', '.ruff.toml', 'mypy.ini', '.mypy.ini',
+    '.pydocstyle', '.bandit', '.prospector.yaml', '.sourcery.yaml',
+)
+
+def list_python_files(target_dir: Path, pathspec: str = '*.py') -> List[str]:
+    """
+    List the Python files tracked by git under a directory, or only those matching pathspec.
+
+    Paths are returned as plain strings, built once here, so the filtering,
+    hashing and argv construction that follow never re-create Path objects.
+    """
+    inside = subprocess.run(['git', '-C', str(target_dir), 'rev-parse', '--is-inside-work-tree'], capture_output=True, text=True)
+    if inside.stdout.strip() != 'true':
+        # Validation stages accepted changes in the git index and rolls back from it
+        raise RuntimeError(f"{target_dir} is not inside a git work tree; optimization requires git to roll back changes.")
+    result = subprocess.run(['git', '-C', str(target_dir), 'ls-files', '-z', '--', pathspec], capture_output=True, check=True)
+    # The index still lists tracked files deleted from the working tree, e.g. by the pre-optimization hook
+    return [file_path for file_path in join_git_paths(target_dir, result.stdout) if os.path.isfile(file_path)]
+
+def join_git_paths(target_dir: Path, output: bytes) -> List[str]:
+    """Turn NUL-separated paths printed by git relative to target_dir into path strings."""
+    prefix = os.path.join(str(target_dir), '')
+    return [prefix + os.fsdecode(entry) for entry in output.split(b'\x00') if entry]
+
+def glob_to_regex(glob: str) -> str:
+    """Translate one path component of a glob into a regex in which '*', '?' and character classes never match a separator."""
+    parts, index = [], 0
+    while index < len(glob):
+        char = glob[index]
+        index += 1
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[':
+            # A leading '!' negates the class and a ']' right after the bracket is a literal
+            end = index + (index < len(glob) and glob[index] == '!')
+            end = glob.find(']', end + (end < len(glob) and glob[end] == ']'))
+            if end < 0:
+                parts.append(re.escape(char))
+                continue
+            parts.append(class_to_regex(glob[index:end]))
+            index = end + 1
+        else:
+            parts.append(re.escape(char))
+    return ''.join(parts)
+
+def class_to_regex(members: str) -> str:
+    """
+    Translate the members of a glob character class, as fnmatch reads them, into a regex that excludes '/'.
+
+    Every member is escaped, so '-', '[', '^' and '\\' are literals unless a
+    '-' stands between two members. Reversed ranges match nothing instead of
+    being rejected by re.
+    """
+    negated = members.startswith('!')
+    if negated:
+        members = members[1:]
+    items, index = [], 0
+    while index < len(members):
+        if index + 2 < len(members) and members[index + 1] == '-':
+            low, high = members[index], members[index + 2]
+            if low <= high:
+                items.append(f'{re.escape(low)}-{re.escape(high)}')
+            index += 3
+        else:
+            items.append(re.escape(members[index]))
+            index += 1
+    if negated:
+        return f'[^/{"".join(items)}]'
+    return f'(?!/)[{"".join(items)}]' if items else '(?!)'
+
+def compile_exclusions(patterns: List[str]) -> Optional[Pattern[str]]:
+    """
+    Compile exclusion globs into a single regex.
+
+    Like PurePath.match, a pattern matches the trailing components of a path,
+    so 'README.md' excludes that file in any directory and '*' never spans
+    a directory separator. Search from the length of the root prefix so that
+    only the components below the optimized directory are considered.
+    """
+    # Split into components first, as PurePath.match does, so a '/' inside brackets never forms a class
+    globs = [PurePosixPath(pattern.strip('/')).parts for pattern in patterns if isinstance(pattern, str)]
+    globs = [components for components in globs if components]
+    if not globs:
+        return None
+    # The lookbehind anchors on a component boundary and, unlike '^', also sees the separator before the search position
+    return re.compile('|'.join(
+        f"(?<![^/])(?:{'/'.join(map(glob_to_regex, components))})\\Z" for components in globs
+    ))
+
+def modified_files(target_dir: Path) -> List[str]:
+    """Return the tracked files under target_dir whose working tree content differs from the git index."""
+    result = subprocess.run(['git', '-C', str(target_dir), 'diff', '--name-only', '--relative', '-z'], capture_output=True, check=True)
+    return join_git_paths(target_dir, result.stdout)
+
+def restore_files(target_dir: Path, files: List[str]) -> None:
+    """Restore files to the content staged in the git index, i.e. their last validated state."""
+    pathspecs = b''.join(os.fsencode(file_path) + b'\x00' for file_path in files)
+    subprocess.run(
+        ['git', '-C', str(target_dir), 'checkout', '--pathspec-from-file=-', '--pathspec-file-nul', '--'],
+        input=pathspecs,
+        check=True,
+    )
+
+def stage_files(target_dir: Path, files: List[str]) -> None:
+    """Stage files in the git index, marking their current content as validated."""
+    pathspecs = b''.join(os.fsencode(file_path) + b'\x00' for file_path in files)
+    subprocess.run(
+        ['git', '-C', str(target_dir), 'add', '--pathspec-from-file=-', '--pathspec-file-nul', '--'],
+        input=pathspecs,
+        check=True,
+    )
+
+def open_cache(cache_path: Path = CACHE_PATH) -> sqlite3.Connection:
+    """Open the persistent cache of (tool, version and settings, content hash) triples that already passed."""
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(cache_path), timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS cache (tool TEXT, version TEXT, hash BLOB, PRIMARY KEY (tool, version, hash))"
+    )
+    return connection
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    """Return the version string reported by a tool, or an empty string if it cannot be determined."""
+    try:
+        result = subprocess.run([tool, '--version'], capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout.strip() or result.stderr.strip()
+
+def config_digest(target_dir: Path, project_root: Path) -> hashlib.blake2b:
+    """Hash the tool configuration files in target_dir and its parents up to project_root, where the tools look for them."""
+    digest = hashlib.blake2b(digest_size=16)
+    for directory in [target_dir, *target_dir.parents]:
+        for name in TOOL_CONFIG_FILES:
+            config_path = directory / name
+            if config_path.is_file():
+                digest.update(os.fsencode(config_path) + b'\x00' + config_path.read_bytes())
+        if directory == project_root:
+            break
+    return digest
+
+def file_digest(file_path: str) -> bytes:
+    """Hash the raw bytes of a file."""
+    with open(file_path, 'rb') as file:
+        return hashlib.blake2b(file.read(), digest_size=16).digest()
+
+def uncached_files(cache: sqlite3.Connection, tool: str, version: str, files: List[str]) -> Dict[str, bytes]:
+    """Return the files whose current content has not yet been processed successfully by the tool, with their digests."""
+    digests = {file_path: file_digest(file_path) for file_path in files}
+    placeholders = ", ".join("?" * len(digests))
+    rows = cache.execute(
+        f"SELECT hash FROM cache WHERE tool = ? AND version = ? AND hash IN ({placeholders})",
+        (tool, version, *digests.values()),
+    )
+    known = {row[0] for row in rows}
+    return {file_path: digest for file_path, digest in digests.items() if digest not in known}
+
+def record_digests(cache: sqlite3.Connection, tool: str, version: str, digests: Iterable[bytes]) -> None:
+    """Remember file contents, by digest, as successfully processed by the tool."""
+    with cache:
+        cache.executemany(
+            "INSERT OR IGNORE INTO cache (tool, version, hash) VALUES (?, ?, ?)",
+            [(tool, version, digest) for digest in digests],
+        )
+
+def parses(file_path: str) -> bool:
+    """Return whether a file is valid Python for this interpreter, which is also the one running the tests."""
+    try:
+        with open(file_path, 'rb') as file:
+            ast.parse(file.read(), filename=file_path)
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+def split_batches(files: List[str], workers: int) -> List[List[str]]:
+    """
+    Split files into as few shards as keep every worker busy, balanced by size.
+
+    Each shard costs one start-up (interpreter and imports, for Python tools)
+    per tool, so shards are sized by worker count rather than a fixed file
+    count; MAX_BATCH_SIZE only kicks in for very large trees. Files are dealt
+    largest first to the lightest shard, so a few big modules do not leave
+    the other workers idle while one shard finishes.
+    """
+    count = max(min(workers, len(files)), math.ceil(len(files) / MAX_BATCH_SIZE), 1)
+    capacity = math.ceil(len(files) / count)
+
+    sizes = {}
+    for file_path in files:
+        try:
+            sizes[file_path] = os.stat(file_path).st_size
+        except OSError:
+            sizes[file_path] = 0
+
+    shards: List[List[str]] = [[] for _ in range(count)]
+    lightest = [(0, index) for index in range(count)]
+    for file_path in sorted(files, key=sizes.__getitem__, reverse=True):
+        load, index = heapq.heappop(lightest)
+        shards[index].append(file_path)
+        # Full shards drop out so none grows past its share of files
+        if len(shards[index]) < capacity:
+            heapq.heappush(lightest, (load + sizes[file_path], index))
+    return [sorted(shard) for shard in shards if shard]
+
+async def run_command(argv: List[str], cwd: Optional[Path] = None) -> None:
+    """Run a command without blocking the event loop, raising CalledProcessError on failure."""
+    process = await asyncio.create_subprocess_exec(*argv, cwd=cwd)
+    try:
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, argv)
+
+async def run_batched(argv: List[str], files: List[str]) -> None:
+    """Run a tool once over a batch of files."""
+    await run_command([*argv, *files])
+
+def run_each(build_argv: Callable[[Path], Optional[List[str]]], keep_going: bool = False) -> Callable[[List[str]], Awaitable[None]]:
+    """
+    Adapt a per-file command for tools that cannot take several files at once; it runs from the file's directory.
+
+    With keep_going, a failure does not stop the remaining files from being
+    checked; the first one is raised once the whole batch has run.
+    """
+    async def runner(files: List[str]) -> None:
+        first_failure = None
+        for file_path in files:
+            path = Path(file_path)
+            argv = build_argv(path)
+            if argv is None:
+                continue
+            try:
+                await run_command(argv, cwd=path.parent)
+            except subprocess.CalledProcessError as e:
+                if not keep_going:
+                    raise
+                first_failure = first_failure or e
+        if first_failure is not None:
+            raise first_failure
+    return runner
+
+# Strategies as (name, executable, runner, rewrites files, command); each runner receives a batch of files,
+# and the command is part of the cache key, so changing a tool's arguments re-runs it on every file
+Strategy = Tuple[str, str, Callable[[List[str]], Awaitable[None]], bool, str]
+
+# Tools that rewrite files, as (name, argv); the whole batch of files is appended to argv
+REWRITING_TOOLS = [
+    ("Ruff Linting", ['ruff', 'check', '--fix', '--exit-zero', '--quiet', '--extend-select', 'I,PL,UP,F,E,W']),  # Lint, sort imports, upgrade syntax and drop unused code in one pass
+    ("Ruff Formatting", ['ruff', 'format', '--quiet']),  # Format code with Ruff (Black-compatible)
+    ("Docformatter Docstring Formatting", ['docformatter', '-i']),  # Format docstrings
+]
+
+# Python tools whose rules Ruff Linting already applies, used only when Ruff is not installed
+RUFF_FALLBACK_REWRITING_TOOLS = [
+    ("Pyupgrade Syntax Upgrade", ['pyupgrade']),  # Upgrade syntax to latest standards
+    ("Autoflake Dead Code Removal", ['autoflake', '--in-place', '--remove-unused-variables', '--remove-all-unused-imports']),  # Remove unused code
+    ("Remove Unused Imports (Reorder Python Imports)", ['reorder-python-imports', '--remove-unused']),  # Remove unused imports
+]
+
+# Tools that only accept a single path, as (name, executable, argv builder returning None to skip a file, rewrites files)
+PER_FILE_TOOLS = [
+    ("Safety Vulnerability Check", 'safety', lambda f: ['safety', 'check', '-r', 'requirements.txt'] if f.name == "requirements.txt" else None, False),  # Security check on dependencies
+    ("Add Import Type Hints (MonkeyType)", 'monkeytype', lambda f: ['monkeytype', 'apply', f.stem], True),  # Add type hints with MonkeyType
+    ("Check Manifest Integrity", 'check-manifest', lambda f: ['check-manifest'] if f.name == "setup.py" else None, False),  # Check Python package manifest
+    ("Pyroma Quality Rating", 'pyroma', lambda f: ['pyroma', str(f)], False),  # Evaluate code quality with Pyroma
+    ("TruffleHog Secrets Detection", 'trufflehog', lambda f: ['trufflehog', 'filesystem', str(f)], False),  # Detect secrets in the code
+    ("SnakeViz Profiling", 'snakeviz', lambda f: ['snakeviz', str(f)], False),  # Visualize profiling data with SnakeViz
+    ("Jedi Refactoring", 'jedi', lambda f: ['jedi', 'refactor', str(f)], False),  # Refactor code with Jedi
+    ("Pygments Code Coloring Check", 'pygmentize', lambda f: ['pygmentize', str(f)], False),  # Highlight the code for readability
+    ("Linters Aggregator (prospector)", 'prospector', lambda f: ['prospector', str(f)], False),  # Aggregate linters for more insights
+]
+
+# Report-only tools, as (name, argv); a non-zero exit is logged as findings without rolling anything back
+REPORTING_TOOLS = [
+    ("Mypy Type Checking", ['mypy']),  # Static type checking
+    ("Radon Complexity Check", ['radon', 'cc', '-a']),  # Complexity analysis
+    ("Bandit Security Scan", ['bandit']),  # Scan for security issues
+    ("Ruff Lint Report", ['ruff', 'check', '--no-fix', '--quiet', '--select', 'E,W,F,C90,D', '--config', 'lint.mccabe.max-complexity = 5']),  # Pycodestyle, Pyflakes, Mccabe and Pydocstyle rules in one pass
+    ("Vulture Dead Code Detection", ['vulture']),  # Detect dead code with Vulture
+    ("Sourcery Code Refactoring", ['sourcery', 'review']),  # Refactor code using Sourcery
+]
+
+# Python tools whose rules Ruff Lint Report already checks, used only when Ruff is not installed
+RUFF_FALLBACK_REPORTING_TOOLS = [
+    ("Flake8 Linting", ['flake8', '--max-complexity=5', '--select=E,W,F,C9']),  # Pycodestyle, Pyflakes and strictest Mccabe complexity checks in one pass
+    ("Pydocstyle Docstring Style Check", ['pydocstyle']),  # Enforce docstring style
+]
+
+# Executables resolved once at start-up; strategies whose tool is not installed are skipped
+# instead of failing, since a missing binary fails the same way on every file and attempt
+AVAILABLE_TOOLS = {
+    tool: shutil.which(tool)
+    for tool in {
+        *(argv[0] for _, argv in REWRITING_TOOLS + RUFF_FALLBACK_REWRITING_TOOLS),
+        *(tool for _, tool, _, _ in PER_FILE_TOOLS),
+        *(argv[0] for _, argv in REPORTING_TOOLS + RUFF_FALLBACK_REPORTING_TOOLS),
+    }
+}
+USE_RUFF_FALLBACKS = AVAILABLE_TOOLS['ruff'] is None
+
+def batched_strategy(name: str, argv: List[str], rewrites_files: bool) -> Strategy:
+    """Build the strategy running an installed tool once per batch of files."""
+    resolved = [AVAILABLE_TOOLS[argv[0]], *argv[1:]]
+    return (name, argv[0], functools.partial(run_batched, resolved), rewrites_files, shlex.join(resolved))
+
+def per_file_command(tool: str, build_argv: Callable[[Path], Optional[List[str]]]) -> str:
+    """Describe a per-file command by its executable and the literals and names its argv builder uses."""
+    code = build_argv.__code__
+    return f"{AVAILABLE_TOOLS[tool]} {code.co_consts!r} {code.co_names!r}"
+
 def optimize_python_files(
     target_dir: Path,
     excluded_files: List[str],
     max_iterations: int,
     ignore_failure: bool,
     venv_path: Path,
+    project_root: Path,
     run_tests_command: Optional[str] = "pytest"
 ) -> None:
-    """Perform optimization on Python files using multiple optimization tools."""
-    logger.info(f"Starting optimization in directory: {target_dir}")
-    python_files = list(target_dir.rglob("*.py"))
+    """Perform optimization on Python files using multiple optimization tools, running the tests from project_root."""
+    logger.info("Starting optimization in directory: %s", target_dir)
+    if not target_dir.exists():
+        logger.info("No files to optimize in %s: the path does not exist. Exiting optimization.", target_dir)
+        return
+    exclusions = compile_exclusions(excluded_files)
+    if target_dir.is_dir():
+        python_files = list_python_files(target_dir)
+    else:
+        # A single file is optimized from its directory, which git and the tests work in
+        python_files = list_python_files(target_dir.parent, f":(literal){target_dir.name}") if target_dir.suffix == '.py' else []
+        target_dir = target_dir.parent
 
     # Filter out excluded files
-    files_to_optimize = [
-        file_path for file_path in python_files
-        if not any(file_path.match(pattern) for pattern in excluded_files)
-    ]
+    if exclusions is None:
+        files_to_optimize = python_files
+    else:
+        is_excluded = exclusions.search
+        start = len(os.path.join(str(target_dir), ''))
+        files_to_optimize = [file_path for file_path in python_files if not is_excluded(file_path, start)]
 
     if not files_to_optimize:
-        logger.info(f"No files to optimize in {target_dir}. Exiting optimization.")
+        logger.info("No files to optimize in %s. Exiting optimization.", target_dir)
         return
 
-    # Define optimization strategies
-    optimization_strategies = [
-        ("Black Formatting", lambda f: subprocess.run(['black', str(f)], check=True)),  # Format code with Black
-        ("Flake8 Linting", lambda f: subprocess.run(['flake8', str(f)], check=True)),  # Lint with Flake8
-        ("isort Import Sorting", lambda f: subprocess.run(['isort', str(f)], check=True)),  # Sort imports with isort
-        ("Mypy Type Checking", lambda f: subprocess.run(['mypy', str(f)], check=True)),  # Static type checking
-        ("Pylint Checking", lambda f: subprocess.run(['pylint', str(f)], check=True)),  # Lint with Pylint
-        ("Radon Complexity Check", lambda f: subprocess.run(['radon', 'cc', '-a', str(f)], check=True)),  # Complexity analysis
-        ("Bandit Security Scan", lambda f: subprocess.run(['bandit', '-r', str(f)], check=True)),  # Scan for security issues
-        ("Pyflakes Linting", lambda f: subprocess.run(['pyflakes', str(f)], check=True)),  # Lint with Pyflakes
-        ("Yapf Formatting", lambda f: subprocess.run(['yapf', '-i', str(f)], check=True)),  # Format code with Yapf
-        ("Autopep8 Formatting", lambda f: subprocess.run(['autopep8', '--in-place', str(f)], check=True)),  # Format code with autopep8
-        ("Pyupgrade Syntax Upgrade", lambda f: subprocess.run(['pyupgrade', str(f)], check=True)),  # Upgrade syntax to latest standards
-        ("Docformatter Docstring Formatting", lambda f: subprocess.run(['docformatter', '-i', str(f)], check=True)),  # Format docstrings
-        ("Pydocstyle Docstring Style Check", lambda f: subprocess.run(['pydocstyle', str(f)], check=True)),  # Enforce docstring style
-        ("Safety Vulnerability Check", lambda f: subprocess.run(['safety', 'check', '-r', 'requirements.txt'], check=True) if f.name == "requirements.txt" else None),  # Security check on dependencies
-        ("Vulture Dead Code Detection", lambda f: subprocess.run(['vulture', str(f)], check=True)),  # Detect dead code with Vulture
-        ("Mccabe Complexity Check", lambda f: subprocess.run(['flake8', '--max-complexity', '10', str(f)], check=True)),  # Check code complexity with Mccabe
-        ("Duplicated Code Check (Flake8-Cognitive Complexity)", lambda f: subprocess.run(['flake8', '--select', 'C9', str(f)], check=True)),  # Check for cognitive complexity
-        ("Pycodestyle Linting", lambda f: subprocess.run(['pycodestyle', str(f)], check=True)),  # Lint with Pycodestyle
-        ("Autoflake Dead Code Removal", lambda f: subprocess.run(['autoflake', '--in-place', '--remove-unused-variables', '--remove-all-unused-imports', str(f)], check=True)),  # Remove unused code
-        ("Remove Unused Imports (Reorder Python Imports)", lambda f: subprocess.run(['reorder-python-imports', '--remove-unused', str(f)], check=True)),  # Remove unused imports
-        ("Add Import Type Hints (MonkeyType)", lambda f: subprocess.run(['monkeytype', 'apply', f'{f.stem}'], cwd=f.parent, check=True)),  # Add type hints with MonkeyType
-        ("Cyclomatic Complexity Report (Lizard)", lambda f: subprocess.run(['lizard', str(f)], check=True)),  # Analyze cyclomatic complexity
-        ("Check Manifest Integrity", lambda f: subprocess.run(['check-manifest'], check=True) if f.name == "setup.py" else None),  # Check Python package manifest
-        ("Pyroma Quality Rating", lambda f: subprocess.run(['pyroma', str(f)], check=True)),  # Evaluate code quality with Pyroma
-        ("TruffleHog Secrets Detection", lambda f: subprocess.run(['trufflehog', 'filesystem', str(f)], check=True)),  # Detect secrets in the code
-        ("Sourcery Code Refactoring", lambda f: subprocess.run(['sourcery', 'review', str(f)], check=True)),  # Refactor code using Sourcery
-        ("SnakeViz Profiling", lambda f: subprocess.run(['snakeviz', str(f)], check=True)),  # Visualize profiling data with SnakeViz
-        ("Jedi Refactoring", lambda f: subprocess.run(['jedi', 'refactor', str(f)], check=True)),  # Refactor code with Jedi
-        ("mccabe Cyclomatic Complexity Reduction", lambda f: subprocess.run(['flake8', '--max-complexity', '5', str(f)], check=True)),  # Reduce cyclomatic complexity further
-        ("Pygments Code Coloring Check", lambda f: subprocess.run(['pygmentize', str(f)], check=True)),  # Highlight the code for readability
-        ("Linters Aggregator (prospector)", lambda f: subprocess.run(['prospector', str(f)], check=True)),  # Aggregate linters for more insights
-    ]
+    # Changes made before optimization (e.g. by the pre-optimization hook) form the baseline a failed pass rolls back to
+    baseline_changes = modified_files(target_dir)
+    if baseline_changes:
+        stage_files(target_dir, baseline_changes)
+
+    async def apply_to_batch(batch: List[str], strategy: Strategy) -> bool:
+        """Apply one strategy to a batch of files, returning whether it succeeded."""
+        optimizer_name, tool, optimizer, rewrites_files, command = strategy
+
+        # Skip files this tool already processed successfully in their current state, with the same command and configuration
+        settings = tool_settings.copy()
+        settings.update(command.encode())
+        version = f"{await asyncio.to_thread(tool_version, tool)} {settings.hexdigest()}"
+        pending = uncached_files(cache, optimizer_name, version, batch)
+        if not pending:
+            logger.info("Skipping %s: all %s files unchanged since its last successful run", optimizer_name, len(batch))
+            return True
+
+        # Deterministic tools fail the same way every time, so only transient ones are retried
+        attempts = max(1, min(RETRY_ATTEMPTS.get(tool, 1), max_iterations))
+        for attempt in range(attempts):
+            try:
+                logger.info("Applying %s to %s files (Attempt %s/%s)...", optimizer_name, len(pending), attempt + 1, attempts)
+                await optimizer(list(pending))
+                record_digests(cache, optimizer_name, version, [file_digest(file_path) for file_path in pending])
+                return True
+
+            except subprocess.CalledProcessError as e:
+                if not rewrites_files:
+                    # Report-only tools leave the files untouched, so they can be retried and their findings need no rollback
+                    if attempt < attempts - 1:
+                        logger.warning("%s failed (Attempt %s/%s), retrying: %s", optimizer_name, attempt + 1, attempts, e)
+                        await asyncio.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+                        continue
+                    logger.warning("%s reported issues in %s files: %s", optimizer_name, len(pending), e)
+                    return False
+                logger.warning("Optimization failed with %s (Attempt %s/%s): %s", optimizer_name, attempt + 1, attempts, e)
+                if attempt == attempts - 1:
+                    # Restored once all batches finish, since concurrent checkouts would race for the index lock
+                    failed_batches.append(batch)
+                if not ignore_failure:
+                    logger.error("Stopping optimization due to failure with %s", optimizer_name)
+                    raise
+                if attempt < attempts - 1:
+                    await asyncio.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+        return False
+
+    # Batches of the current pass whose rewriting tool failed and still have to be rolled back
+    failed_batches: List[List[str]] = []
 
-    def optimize_and_validate(file_path: Path, optimizers: List[Callable[[Path], None]]) -> None:
+    def validate_pass(optimizer_name: str) -> None:
         """
-        Optimize a single file with the provided list of optimizers and validate functionality.
+        Run the tests once over everything a strategy changed.
+
+        Accepted changes are staged, so the git index always holds the last
+        validated state and a failed pass can be rolled back from it.
         """
-        logger.info(f"Starting optimization for {file_path}")
-        original_content = file_path.read_text(encoding='utf-8')  # Save original state for rollback if needed
-        successful_optimizations = 0
+        # Every tracked file counts, since tools may also touch siblings such as __init__.py or excluded files
+        changed_files = modified_files(target_dir)
+        if not changed_files:
+            logger.info("%s left every file unchanged, skipping validation.", optimizer_name)
+            return
+        logger.info("Running tests to validate changes to %s files made by %s...", len(changed_files), optimizer_name)
+        try:
+            run_tests(project_root, venv_path, run_tests_command)
+        except subprocess.CalledProcessError:
+            logger.warning("Restoring content of %s files because validation of %s failed.", len(changed_files), optimizer_name)
+            restore_files(target_dir, changed_files)
+            if not ignore_failure:
+                raise
+        else:
+            stage_files(target_dir, changed_files)
+
+    def restore_unvalidated() -> None:
+        """Roll back every change not yet accepted by a validation run, including half-written output of killed tools."""
+        changed_files = modified_files(target_dir)
+        if changed_files:
+            logger.warning("Restoring content of %s files left unvalidated by the aborted pass.", len(changed_files))
+            restore_files(target_dir, changed_files)
 
-        for optimizer_name, optimizer in optimizers:
-            validation_successful = False
+    async def optimize_all(batches: List[List[str]]) -> None:
+        """Apply each strategy to every batch concurrently, bounded by the number of CPUs, validating after each pass."""
+        # Each shard runs in its own child processes, so the GIL never limits the tools
+        semaphore = asyncio.Semaphore(min(os.cpu_count() or 1, len(batches)))
 
-            for iteration in range(max_iterations):
+        async def bounded(batch: List[str], strategy: Strategy) -> bool:
+            async with semaphore:
+                return await apply_to_batch(batch, strategy)
+
+        for strategy in optimization_strategies:
+            optimizer_name, _, _, rewrites_files, _ = strategy
+            failed_batches.clear()
+            tasks = [asyncio.create_task(bounded(batch, strategy)) for batch in batches]
+            succeeded = 0
+            for task in asyncio.as_completed(tasks):
                 try:
-                    logger.info(f"Applying {optimizer_name} to {file_path} (Iteration {iteration + 1})...")
-                    optimizer(file_path)
-
-                    # Run tests to validate changes
-                    logger.info(f"Running tests to validate changes after applying {optimizer_name} to {file_path}...")
-                    run_tests(target_dir, venv_path, run_tests_command)
-
-                    validation_successful = True
-                    successful_optimizations += 1
-                    logger.info(f"Successfully optimized {file_path} with {optimizer_name} (Iteration {iteration + 1})")
-                    break
-
-                except subprocess.CalledProcessError as e:
-                    logger.warning(f"Optimization or validation failed for {file_path} with {optimizer_name} (Iteration {iteration + 1}): {e}")
-                    if iteration == max_iterations - 1 and not validation_successful:
-                        logger.warning(f"Restoring original content of {file_path} due to repeated failures.")
-                        file_path.write_text(original_content, encoding='utf-8')
+                    succeeded += await task
+                except Exception as e:
+                    logger.error("Optimization process failed: %s", e)
                     if not ignore_failure:
-                        logger.error(f"Stopping optimization due to failure in {file_path} with {optimizer_name}")
+                        logger.error("Terminating further optimization due to error.")
+                        for pending in tasks:
+                            pending.cancel()
+                        # Wait for the killed tools to exit so none writes after the rollback
+                        await asyncio.gather(*tasks, return_exceptions=True)
+                        await asyncio.to_thread(restore_unvalidated)
                         raise
+            logger.info("%s succeeded on %s/%s batches.", optimizer_name, succeeded, len(batches))
 
-        logger.info(f"Completed optimization for {file_path} with {successful_optimizations}/{len(optimizers)} optimizations successfully applied.")
+            if failed_batches:
+                failed_files = [file_path for batch in failed_batches for file_path in batch]
+                logger.warning("Restoring content of %s files after %s failed.", len(failed_files), optimizer_name)
+                await asyncio.to_thread(restore_files, target_dir, failed_files)
 
-    # Use thread-based parallelism to optimize multiple files concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        future_to_file = {executor.submit(optimize_and_validate, file_path, optimization_strategies): file_path for file_path in files_to_optimize}
+            # A single git diff covers siblings and excluded files too, and spares the test run for no-op passes
+            if rewrites_files:
+                await asyncio.to_thread(validate_pass, optimizer_name)
 
-        for future in concurrent.futures.as_completed(future_to_file):
-            file_path = future_to_file[future]
-            try:
-                future.result()
-            except Exception as e:
-                logger.error(f"Optimization process failed for {file_path}: {e}")
-                if not ignore_failure:
-                    logger.error("Terminating further optimization due to error.")
-                    break
+    # Rewriting tools run first so the report-only tools see the final code
+    rewriting_tools = REWRITING_TOOLS + (RUFF_FALLBACK_REWRITING_TOOLS if USE_RUFF_FALLBACKS else [])
+    reporting_tools = REPORTING_TOOLS + (RUFF_FALLBACK_REPORTING_TOOLS if USE_RUFF_FALLBACKS else [])
+    optimization_strategies: List[Strategy] = [
+        *(batched_strategy(name, argv, True) for name, argv in rewriting_tools if AVAILABLE_TOOLS[argv[0]]),
+        *((name, tool, run_each(build_argv, keep_going=not rewrites), rewrites, per_file_command(tool, build_argv))
+          for name, tool, build_argv, rewrites in PER_FILE_TOOLS if AVAILABLE_TOOLS[tool]),
+        *(batched_strategy(name, argv, False) for name, argv in reporting_tools if AVAILABLE_TOOLS[argv[0]]),
+    ]
+    tool_settings = config_digest(target_dir, project_root)
+
+    cache = open_cache()
+    try:
+        # A file that does not parse fails every tool on its whole shard, so it is left out up front
+        unchecked = uncached_files(cache, SYNTAX_CHECK, sys.version, files_to_optimize)
+        invalid_files = {file_path for file_path in unchecked if not parses(file_path)}
+        record_digests(cache, SYNTAX_CHECK, sys.version, [digest for file_path, digest in unchecked.items() if file_path not in invalid_files])
+        if invalid_files:
+            logger.warning("Skipping %s files with syntax errors: %s", len(invalid_files), ', '.join(sorted(invalid_files)))
+            files_to_optimize = [file_path for file_path in files_to_optimize if file_path not in invalid_files]
+
+        # Optimize batches of files concurrently as asynchronous subprocesses
+        batches = split_batches(files_to_optimize, os.cpu_count() or 1)
+        if batches:
+            asyncio.run(optimize_all(batches))
+    finally:
+        cache.close()
 
     logger.info("Optimization process completed for all files.")
 
 # =========================== Git Commit and Pull Request ===========================
 
-def commit_and_create_pr(target_dir: Path, repo_name: str, branch_name: str, auth_token: str) -> None:
-    """Commit changes and create a pull request."""
-    os.chdir(target_dir)
+def github_repository(repo_url: str) -> str:
+    """Extract the 'owner/name' slug from a GitHub repository URL."""
+    path = urllib.parse.urlparse(repo_url).path.strip('/')
+    return path[:-len('.git')] if path.endswith('.git') else path
 
+def github_client(auth_token: str) -> httpx.Client:
+    """Create a GitHub API client; share one across repositories so they reuse its connection pool."""
+    return httpx.Client(
+        base_url=GITHUB_API_URL,
+        http2=True,
+        headers={'Authorization': f'token {auth_token}', 'Accept': 'application/vnd.github+json'},
+        timeout=30,
+    )
+
+def commit_and_create_pr(target_dir: Path, repo_name: str, repo_url: str, branch_name: str, github: httpx.Client) -> None:
+    """Commit changes and create a pull request."""
     new_branch = f"optimize/{branch_name}"
-    logger.info(f"Creating new branch '{new_branch}' for optimization...")
+    git = ['git', '-C', str(target_dir)]
+    logger.info("Creating new branch '%s' for optimization...", new_branch)
     try:
-        subprocess.run(['git', 'checkout', '-b', new_branch], check=True)
+        subprocess.run([*git, 'checkout', '-B', new_branch], check=True)
 
         # Stage changes and commit
-        subprocess.run(['git', 'add', '.'], check=True)
+        subprocess.run([*git, 'add', '.'], check=True)
+        if subprocess.run([*git, 'diff', '--cached', '--quiet']).returncode == 0:
+            logger.info("No optimizations to commit for repository '%s'.", repo_name)
+            return
         commit_message = f"Optimized code for repository '{repo_name}' - see details in commit."
-        subprocess.run(['git', 'commit', '-m', commit_message], check=True)
+        subprocess.run([*git, 'commit', '-m', commit_message], check=True)
 
-        # Push changes to remote
-        repo_url = f"https://{auth_token}@github.com/{repo_name}.git"
-        subprocess.run(['git', 'push', '-u', 'origin', new_branch], check=True)
+        # Push changes to remote; not retried, as a rejected push (non-fast-forward, protected branch) fails the same way every time
+        subprocess.run([*git, 'push', '-u', 'origin', new_branch], check=True, env={**os.environ, **GIT_NETWORK_ENV})
 
-        # Create a pull request using GitHub CLI
+        # Create a pull request through the GitHub REST API
         pr_title = "Automated Code Optimization"
         pr_body = "This PR contains automated optimizations for the Python code, improving formatting and compliance with best practices."
-        subprocess.run(['gh', 'pr', 'create', '--title', pr_title, '--body', pr_body, '--base', branch_name], check=True)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to commit or create PR: {e}")
+        response = github.post(
+            f"/repos/{github_repository(repo_url)}/pulls",
+            json={'title': pr_title, 'body': pr_body, 'head': new_branch, 'base': branch_name},
+        )
+        response.raise_for_status()
+        logger.info("Created pull request %s", response.json()['html_url'])
+    except (subprocess.CalledProcessError, httpx.HTTPError) as e:
+        logger.error("Failed to commit or create PR: %s", e)
         raise
 
 # =========================== Main Process ===========================
 
+@dataclasses.dataclass
+class RepoJob:
+    """Settings and working state of one repository as it moves through the pipeline stages."""
+    repo: dict
+    auth_token: str
+    github: httpx.Client
+    paths_to_optimize: List[str]
+    excluded_files: List[str]
+    max_iterations: int
+    ignore_failure: bool
+    sparse_checkout: bool
+    target_path: Optional[Path] = None
+    venv_path: Optional[Path] = None
+    lock_fd: Optional[int] = None  # Held from cloning until the job leaves the pipeline
+
+def prepare_job(repo: dict, config: dict, auth_token: str, github: httpx.Client) -> RepoJob:
+    """Resolve the settings of a repository against the configured defaults."""
+    defaults = config['default_settings']
+    return RepoJob(
+        repo=repo,
+        auth_token=auth_token,
+        github=github,
+        paths_to_optimize=repo.get('paths_to_optimize', defaults.get('paths_to_optimize', [])),
+        excluded_files=repo.get('excluded_files', defaults.get('excluded_files', [])),
+        max_iterations=repo.get('optimization', {}).get('max_iterations', defaults['optimization']['max_iterations']),
+        ignore_failure=repo.get('optimization', {}).get('ignore_failure', defaults['optimization']['ignore_failure']),
+        sparse_checkout=repo.get('sparse_checkout', defaults.get('sparse_checkout', False)),
+    )
+
+def clone_stage(job: RepoJob) -> None:
+    """Clone the repository and run its pre-optimization hook."""
+    logger.info("Processing repository: %s", job.repo['name'])
+
+    # Keep concurrent runs sharing this clone from resetting it until this run has committed or failed
+    job.lock_fd = acquire_file_lock(repository_lock_path(job.repo['name']))
+
+    # Clone repository, materializing only the optimized paths and hook scripts if requested
+    sparse_paths = [*job.paths_to_optimize, "scripts"] if job.sparse_checkout and job.paths_to_optimize else None
+    job.target_path = clone_repository(job.repo['url'], job.repo['branch'], job.auth_token, job.repo['name'], sparse_paths)
+
+    # Execute pre-optimization script if exists
+    pre_optimize_script = job.target_path / "scripts" / "pre_optimize.sh"
+    execute_custom_script(pre_optimize_script)
+
+def install_stage(job: RepoJob) -> None:
+    """Provide a virtual environment with the requirements of every optimized path, resolved together."""
+    job.venv_path = cached_virtual_environment([job.target_path / path / "requirements.txt" for path in job.paths_to_optimize])
+
+def optimize_stage(job: RepoJob) -> None:
+    """Optimize the configured paths and run the post-optimization hook."""
+    for path in job.paths_to_optimize:
+        optimize_python_files(job.target_path / path, job.excluded_files, job.max_iterations, job.ignore_failure, job.venv_path, job.target_path)
+
+    # Execute post-optimization script if exists
+    post_optimize_script = job.target_path / "scripts" / "post_optimize.sh"
+    execute_custom_script(post_optimize_script)
+
+def commit_stage(job: RepoJob) -> None:
+    """Commit the changes and open the pull request."""
+    commit_and_create_pr(job.target_path, job.repo['name'], job.repo['url'], job.repo['branch'], job.github)
+
+def release_job(job: RepoJob) -> None:
+    """Release the clone of a repository that left the pipeline, whether committed, failed or cancelled."""
+    if job.lock_fd is not None:
+        os.close(job.lock_fd)
+        job.lock_fd = None
+
+# Pipeline stages as (name, function, concurrent workers). Cloning is network-bound,
+# pip installs contend for the same caches, and optimization is CPU-bound.
+PIPELINE_STAGES: List[Tuple[str, Callable[[RepoJob], None], int]] = [
+    ("clone", clone_stage, 4),
+    ("install", install_stage, 2),
+    ("optimize", optimize_stage, 8),
+    ("commit", commit_stage, 4),
+]
+
+async def run_pipeline(jobs: List[RepoJob], stages: List[Tuple[str, Callable[[RepoJob], None], int]] = PIPELINE_STAGES) -> None:
+    """
+    Push repositories through the stages as a producer-consumer pipeline.
+
+    Every stage has its own queue and pool of workers, so one repository can be
+    installing while the next is still cloning and another is being optimized.
+    """
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in stages]
+    stopped = asyncio.Event()
+    for job in jobs:
+        queues[0].put_nowait(job)
+
+    async def worker(index: int) -> None:
+        stage_name, stage, _ = stages[index]
+        while True:
+            job = await queues[index].get()
+            forwarded = False
+            try:
+                if not stopped.is_set():
+                    await asyncio.to_thread(stage, job)
+                    if index + 1 < len(stages):
+                        queues[index + 1].put_nowait(job)
+                        forwarded = True
+            except Exception as e:
+                logger.error("Failed to process repository '%s' during %s stage: %s", job.repo['name'], stage_name, e)
+                if not job.ignore_failure:
+                    logger.error("Cancelling remaining repositories due to error.")
+                    stopped.set()
+            finally:
+                if not forwarded:
+                    release_job(job)
+                queues[index].task_done()
+
+    workers = [
+        asyncio.create_task(worker(index))
+        for index, (_, _, concurrency) in enumerate(stages)
+        for _ in range(concurrency)
+    ]
+    try:
+        # A job enters the next queue before it leaves the current one, so joining in order drains the pipeline
+        for stage_queue in queues:
+            await stage_queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Optimize Python files in a repository.")
     parser.add_argument('--config', required=True, help='Path to the configuration YAML file.')
@@ -233,47 +997,28 @@ def main() -> None:
         raise ValueError("Authentication token is required.")
 
     config = load_config(args.config)
+    repositories = config.get("repositories", [])
+    if not repositories:
+        logger.info("No repositories configured.")
+        return
 
-    for repo in config.get("repositories", []):
-        try:
-            logger.info(f"Processing repository: {repo['name']}")
-            repo_url = repo['url']
-            branch = repo['branch']
-            paths_to_optimize = repo.get('paths_to_optimize', config['default_settings'].get('paths_to_optimize', []))
-            excluded_files = repo.get('excluded_files', config['default_settings'].get('excluded_files', []))
-            max_iterations = repo['optimization'].get('max_iterations', config['default_settings']['optimization']['max_iterations'])
-            ignore_failure = repo['optimization'].get('ignore_failure', config['default_settings']['optimization']['ignore_failure'])
-
-            # Clone repository
-            target_path = clone_repository(repo_url, branch, auth_token, repo['name'])
-
-            # Create a virtual environment for isolated dependency management
-            venv_path = create_virtual_environment(target_path)
-
-            # Execute pre-optimization script if exists
-            pre_optimize_script = target_path / "scripts" / "pre_optimize.sh"
-            execute_custom_script(pre_optimize_script)
-
-            # Install requirements if any
-            for path in paths_to_optimize:
-                requirements_path = target_path / path / "requirements.txt"
-                install_requirements(requirements_path, venv_path)
-
-            # Optimize Python files
-            for path in paths_to_optimize:
-                optimize_python_files(target_path / path, excluded_files, max_iterations, ignore_failure, venv_path)
-
-            # Execute post-optimization script if exists
-            post_optimize_script = target_path / "scripts" / "post_optimize.sh"
-            execute_custom_script(post_optimize_script)
-
-            # Commit changes and create PR
-            commit_and_create_pr(target_path, repo['name'], branch, auth_token)
-
-        except Exception as e:
-            logger.error(f"Failed to process repository '{repo['name']}': {e}")
-            if not ignore_failure:
-                break
+    fallback_tools = {argv[0] for _, argv in RUFF_FALLBACK_REWRITING_TOOLS + RUFF_FALLBACK_REPORTING_TOOLS}
+    missing_tools = sorted(
+        tool for tool, path in AVAILABLE_TOOLS.items()
+        if path is None and (USE_RUFF_FALLBACKS or tool not in fallback_tools)
+    )
+    if missing_tools:
+        logger.warning("Skipping optimizers whose tools are not installed: %s", ', '.join(missing_tools))
+
+    # No stage works on more than max_repo_workers repositories at once
+    max_repo_workers = max(1, int(config.get("max_repo_workers", 4)))
+    stages = [(name, stage, min(concurrency, max_repo_workers)) for name, stage, concurrency in PIPELINE_STAGES]
+
+    # One API client for all repositories, so pull requests reuse its HTTP/2 connection
+    with github_client(auth_token) as github, queued_logging():
+        jobs = [prepare_job(repo, config, auth_token, github) for repo in repositories]
+        logger.info("Processing %s repositories with up to %s per stage concurrently.", len(jobs), max_repo_workers)
+        asyncio.run(run_pipeline(jobs, stages))
 
 if __name__ == "__main__":
     main()
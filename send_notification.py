@@ -1,13 +1,63 @@
+import atexit
 import smtplib
 import sys
 import yaml
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_smtp_connections = {}
+
+def get_smtp(smtp_config: dict) -> smtplib.SMTP:
+    """Return an open SMTP connection for the settings, reusing the one from a previous notification."""
+    smtp_server = smtp_config['smtp_server']
+    smtp_port = smtp_config.get('port', 587)
+    use_tls = smtp_config.get('use_tls', True)
+    smtp_user = smtp_config.get('smtp_user')
+    smtp_password = smtp_config.get('smtp_password')
+    key = (smtp_server, smtp_port, use_tls, smtp_user)
+
+    server = _smtp_connections.get(key)
+    if server is not None:
+        try:
+            if server.noop()[0] == 250:
+                return server
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp_connections.pop(key, None)  # The server closed an idle connection
+
+    # Handshake, TLS and login happen once per connection rather than per notification
+    server = smtplib.SMTP(smtp_server, smtp_port)
+    try:
+        if use_tls:
+            server.starttls()
+        # Assuming you add SMTP login info to the config:
+        if smtp_user and smtp_password:
+            server.login(smtp_user, smtp_password)
+    except Exception:
+        server.close()
+        raise
+    _smtp_connections[key] = server
+    return server
+
+@atexit.register
+def close_smtp_connections():
+    for server in _smtp_connections.values():
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+    _smtp_connections.clear()
+
 def send_notification(config_path: str, status: str):
     # Load the configuration to get email settings
     with open(config_path, 'r') as file:
-        config = yaml.safe_load(file)
+        config = yaml.load(file, Loader=SafeLoader)
     
     if not config.get('notifications', {}).get('enable', False):
         print("Notifications are disabled in the config.")
@@ -16,9 +66,6 @@ def send_notification(config_path: str, status: str):
     smtp_config = config['notifications']['email']
     recipients = smtp_config['recipients']
     sender_email = smtp_config['sender_email']
-    smtp_server = smtp_config['smtp_server']
-    smtp_port = smtp_config.get('port', 587)
-    use_tls = smtp_config.get('use_tls', True)
     
     subject = smtp_config.get('subject', f"Notification - Optimization {status}")
     body = f"The optimization process has completed with status: {status}"
@@ -30,15 +77,8 @@ def send_notification(config_path: str, status: str):
     msg.attach(MIMEText(body, 'plain'))
 
     try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            if use_tls:
-                server.starttls()
-            # Assuming you add SMTP login info to the config:
-            smtp_user = smtp_config.get('smtp_user')
-            smtp_password = smtp_config.get('smtp_password')
-            if smtp_user and smtp_password:
-                server.login(smtp_user, smtp_password)
-            server.sendmail(sender_email, recipients, msg.as_string())
+        # One message for all recipients
+        get_smtp(smtp_config).sendmail(sender_email, recipients, msg.as_string())
         print(f"Notification sent to {recipients} regarding {status}.")
     except Exception as e:
         print(f"Failed to send notification: {e}")
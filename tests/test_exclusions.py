@@ -0,0 +1,68 @@
+import random
+import re
+import warnings
+from pathlib import PurePosixPath
+
+import pytest
+
+from optimize import compile_exclusions
+
+ROOT = "/tmp/clone/src"
+
+GLOBS = [
+    "README.md", "*.py", "test_*.py", "pkg/*.py", "*/m?.py", "m[0-9].py", "m[!0-9].py",
+    "[!-a].py", "[-a].py", "[a-].py", "[]a].py", "[!]a].py", "[z-a]*.py", "[z-ab].py", "[!-*]",
+    "[[a].py", "[^a].py", "[a[]", "[\\].py", "[a-c-e].py", "[&&a].py", "[--/].py", "[*-0].py",
+    "[!/].py", "pkg/[", "a[b", "*", "?", "pkg", "**/*.py", "pkg//*.py", "./pkg/*.py", "pkg/./m1.py",
+]
+
+PATHS = [
+    "README.md", "docs/README.md", "m1.py", "mx.py", "pkg/m1.py", "pkg/sub/m2.py", "test_a.py",
+    "pkg/test_b.py", "5.py", "Z.py", "a.py", "-.py", "].py", "b.py", "[.py", "^.py", "\\.py",
+    "d.py", "&.py", "/.py", "pkg/[", "a[b", "pkg", "x", "+", "pkg/x.py", "(.py",
+]
+
+
+def excluded(glob, relative_path):
+    exclusions = compile_exclusions([glob])
+    return exclusions.search(f"{ROOT}/{relative_path}", len(ROOT) + 1) is not None
+
+
+@pytest.mark.parametrize("glob", GLOBS)
+def test_matches_like_pure_path(glob):
+    for relative_path in PATHS:
+        assert excluded(glob, relative_path) == PurePosixPath(relative_path).match(glob), relative_path
+
+
+@pytest.mark.parametrize("glob", GLOBS)
+def test_compiles_without_warnings(glob):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        compile_exclusions([glob])
+
+
+def test_random_globs_match_like_pure_path():
+    rng = random.Random(0)
+    alphabet = "ab-!^[]*?/\\.&"
+    for _ in range(5000):
+        glob = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+        relative_path = "".join(rng.choice("ab-!^[]/\\.&") for _ in range(rng.randint(1, 6)))
+        # Git lists normalized paths only
+        if str(PurePosixPath(relative_path)) != relative_path or relative_path in (".", "/"):
+            continue
+        if not PurePosixPath(glob.strip("/")).parts:
+            assert compile_exclusions([glob]) is None, glob
+            continue
+        assert excluded(glob, relative_path) == PurePosixPath(relative_path).match(glob.strip("/")), (glob, relative_path)
+
+
+def test_empty_patterns_exclude_nothing():
+    assert compile_exclusions([]) is None
+    assert compile_exclusions(["/", ".", [], None]) is None
+
+
+def test_patterns_are_combined():
+    exclusions = compile_exclusions(["README.md", "pkg/*.py"])
+    assert isinstance(exclusions, re.Pattern)
+    assert exclusions.search(f"{ROOT}/pkg/m1.py", len(ROOT) + 1)
+    assert not exclusions.search(f"{ROOT}/pkg/sub/m1.py", len(ROOT) + 1)